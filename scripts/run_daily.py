@@ -1,53 +1,107 @@
 from __future__ import annotations
 
+import asyncio
+import io
 import json
 import os
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List
 
 import requests
 from dateutil import parser as dateparser
-from openai import OpenAI
+from defusedxml import ElementTree as ET
+from openai import AsyncOpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils import (
     ROOT,
+    build_whitelist_set,
     choose_key,
-    is_whitelisted,
+    compile_disease_terms,
+    compile_section_keywords,
+    content_key,
+    get_cached_summary,
     load_disease_config,
     load_journal_whitelist,
     load_json,
     match_disease,
     match_section,
+    minimize_terms,
+    normalize_text,
+    open_cache,
+    put_cached_summaries,
     save_json,
 )
 
 PUBMED_SEARCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 PUBMED_FETCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 EPMC_SEARCH = "https://www.ebi.ac.uk/europepmc/webservices/rest/search"
+LLM_CONCURRENCY = 8
+MAX_QUERY_CHARS = 8 * 1024
+_FAST_DATE_FMTS = ("%Y-%m-%d", "%Y-%b-%d")
+
+
+def make_session() -> requests.Session:
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = make_session()
 
 
 def jst_today() -> datetime:
     return datetime.now(timezone(timedelta(hours=9)))
 
 
+@lru_cache(maxsize=4096)
+def fast_parse(raw: str) -> datetime:
+    # Only full dates take the strptime path: dateutil fills a missing month or
+    # day from today's date, and partial dates must keep sorting that way.
+    for fmt in _FAST_DATE_FMTS:
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            pass
+    try:
+        return dateparser.parse(raw) or datetime(1900, 1, 1)
+    except Exception:
+        return datetime(1900, 1, 1)
+
+
 def build_query(terms: List[str]) -> str:
     or_terms = " OR ".join([f'"{t}"' for t in terms])
     return f"({or_terms}) AND humans[mesh] AND english[lang]"
 
 
+def batch_terms(terms: List[str], max_chars: int = MAX_QUERY_CHARS) -> List[List[str]]:
+    batches = [[]]
+    for t in terms:
+        if batches[-1] and len(build_query(batches[-1] + [t])) > max_chars:
+            batches.append([])
+        batches[-1].append(t)
+    return batches
+
+
 def fetch_pubmed(terms: List[str]) -> List[dict]:
-    params = {
-        "db": "pubmed",
-        "term": build_query(terms),
-        "retmode": "json",
-        "retmax": 200,
-        "reldate": 1,
-        "datetype": "pdat",
-    }
-    r = requests.get(PUBMED_SEARCH, params=params, timeout=30)
-    r.raise_for_status()
-    ids = r.json().get("esearchresult", {}).get("idlist", [])
+    ids = {}
+    for batch in batch_terms(terms):
+        params = {
+            "db": "pubmed",
+            "term": build_query(batch),
+            "retmode": "json",
+            "retmax": 200,
+            "reldate": 1,
+            "datetype": "pdat",
+        }
+        r = SESSION.get(PUBMED_SEARCH, params=params, timeout=30)
+        r.raise_for_status()
+        ids.update(dict.fromkeys(r.json().get("esearchresult", {}).get("idlist", [])))
     if not ids:
         return []
 
@@ -56,14 +110,14 @@ def fetch_pubmed(terms: List[str]) -> List[dict]:
         "id": ",".join(ids),
         "retmode": "xml",
     }
-    f = requests.get(PUBMED_FETCH, params=fetch_params, timeout=30)
+    f = SESSION.get(PUBMED_FETCH, params=fetch_params, timeout=30)
     f.raise_for_status()
 
-    import xml.etree.ElementTree as ET
-
-    root = ET.fromstring(f.text)
     articles = []
-    for article in root.findall(".//PubmedArticle"):
+    # Stream one <PubmedArticle> at a time instead of building the whole tree.
+    for _, article in ET.iterparse(io.BytesIO(f.content), events=("end",)):
+        if article.tag != "PubmedArticle":
+            continue
         pmid = article.findtext(".//PMID")
         title = article.findtext(".//ArticleTitle") or ""
         abstract = " ".join(
@@ -92,6 +146,7 @@ def fetch_pubmed(terms: List[str]) -> List[dict]:
                 "url": url,
             }
         )
+        article.clear()
     return articles
 
 
@@ -107,7 +162,7 @@ def fetch_epmc(terms: List[str], from_date: str, to_date: str) -> List[dict]:
         "pageSize": 100,
         "resultType": "core",
     }
-    r = requests.get(EPMC_SEARCH, params=params, timeout=30)
+    r = SESSION.get(EPMC_SEARCH, params=params, timeout=30)
     r.raise_for_status()
     results = r.json().get("resultList", {}).get("result", [])
 
@@ -138,7 +193,20 @@ def fetch_epmc(terms: List[str], from_date: str, to_date: str) -> List[dict]:
     return articles
 
 
-def summarize(client: OpenAI, title: str, abstract: str) -> str:
+async def complete(client: AsyncOpenAI, sem: asyncio.Semaphore, prompt: str) -> str:
+    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+    async with sem:
+        resp = await client.responses.create(
+            model=model,
+            input=prompt,
+            temperature=0.2,
+        )
+    return resp.output_text.strip()
+
+
+async def summarize(
+    client: AsyncOpenAI, sem: asyncio.Semaphore, title: str, abstract: str
+) -> str:
     if os.environ.get("SKIP_SUMMARY") == "1":
         return ""
     if not abstract:
@@ -149,16 +217,12 @@ def summarize(client: OpenAI, title: str, abstract: str) -> str:
         f"Title: {title}\n"
         f"Abstract: {abstract}"
     )
-    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-    resp = client.responses.create(
-        model=model,
-        input=prompt,
-        temperature=0.2,
-    )
-    return resp.output_text.strip()
+    return await complete(client, sem, prompt)
 
 
-def summarize_short(client: OpenAI, title: str, abstract: str) -> str:
+async def summarize_short(
+    client: AsyncOpenAI, sem: asyncio.Semaphore, title: str, abstract: str
+) -> str:
     if os.environ.get("SKIP_SUMMARY") == "1":
         return ""
     if not abstract:
@@ -169,16 +233,12 @@ def summarize_short(client: OpenAI, title: str, abstract: str) -> str:
         f"Title: {title}\\n"
         f"Abstract: {abstract}"
     )
-    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-    resp = client.responses.create(
-        model=model,
-        input=prompt,
-        temperature=0.2,
-    )
-    return resp.output_text.strip()
+    return await complete(client, sem, prompt)
 
 
-def classify_section_llm(client: OpenAI, title: str, abstract: str) -> str:
+async def classify_section_llm(
+    client: AsyncOpenAI, sem: asyncio.Semaphore, title: str, abstract: str
+) -> str:
     prompt = (
         "次の論文を、以下のいずれか1つに分類してください。"
         "必ずラベルだけを返してください。\\n\\n"
@@ -187,26 +247,56 @@ def classify_section_llm(client: OpenAI, title: str, abstract: str) -> str:
         f"Abstract: {abstract}\\n\\n"
         "Answer:"
     )
-    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-    resp = client.responses.create(
-        model=model,
-        input=prompt,
-        temperature=0.2,
-    )
-    label = resp.output_text.strip().lower()
+    label = (await complete(client, sem, prompt)).lower()
     allowed = {"epidemiology", "diagnosis", "imaging", "treatment", "prognosis"}
     return label if label in allowed else "treatment"
 
 
+async def fill_entry(
+    client: AsyncOpenAI,
+    sem: asyncio.Semaphore,
+    it: dict,
+    entry: dict,
+    use_llm_section: bool,
+) -> None:
+    title = it.get("title", "")
+    abstract = it.get("abstract", "")
+    jobs = {}
+    if not entry["summary_ja"]:
+        jobs["summary_ja"] = summarize(client, sem, title, abstract)
+    if not entry["summary_short_ja"]:
+        jobs["summary_short_ja"] = summarize_short(client, sem, title, abstract)
+    if use_llm_section and not entry["section_llm"]:
+        jobs["section_llm"] = classify_section_llm(client, sem, title, abstract)
+    results = await asyncio.gather(*jobs.values())
+    entry.update(zip(jobs, results))
+
+
+async def fill_entries(pending: List[tuple], use_llm_section: bool) -> None:
+    sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    async with AsyncOpenAI() as client:
+        await asyncio.gather(
+            *[fill_entry(client, sem, it, entry, use_llm_section) for it, entry in pending]
+        )
+
+
+async def complete_all(prompts: List[str]) -> List[str]:
+    sem = asyncio.Semaphore(LLM_CONCURRENCY)
+    async with AsyncOpenAI() as client:
+        return await asyncio.gather(*[complete(client, sem, p) for p in prompts])
+
+
 def main() -> None:
     if not os.environ.get("OPENAI_API_KEY"):
         raise SystemExit("OPENAI_API_KEY is not set")
     diseases_cfg = load_disease_config()
     diseases = diseases_cfg["diseases"]
     sections = diseases_cfg["sections"]
-    whitelist = load_journal_whitelist()
+    disease_terms = compile_disease_terms(diseases)
+    section_keywords = compile_section_keywords(sections)
+    whitelist = build_whitelist_set(load_journal_whitelist())
 
-    terms = sorted({t for d in diseases for t in d.get("terms", [])})
+    terms = minimize_terms(t for d in diseases for t in d.get("terms", []))
 
     today = jst_today()
     from_date = (today - timedelta(days=1)).strftime("%Y-%m-%d")
@@ -218,73 +308,81 @@ def main() -> None:
 
     merged = {}
     for it in items:
+        journal = (it.get("journal") or "").lower().strip()
+        if journal not in whitelist:
+            continue
         key = choose_key(it.get("doi"), it.get("pmid"), it.get("title", ""))
         if key in merged:
             continue
-        if not is_whitelisted(it.get("journal", ""), whitelist):
-            continue
         merged[key] = it
 
     def sort_key(it: dict) -> datetime:
-        raw = it.get("published") or it.get("year") or ""
-        try:
-            return dateparser.parse(str(raw)) or datetime(1900, 1, 1)
-        except Exception:
-            return datetime(1900, 1, 1)
+        return fast_parse(str(it.get("published") or it.get("year") or ""))
 
     max_items = int(os.environ.get("MAX_ITEMS_PER_DAY", "10"))
     merged_items = sorted(merged.values(), key=sort_key, reverse=True)[:max_items]
 
-    client = OpenAI()
-    cache_path = ROOT / "data" / "cache" / "summaries.json"
-    cache = load_json(cache_path, {})
+    cache = open_cache()
+    use_llm_section = os.environ.get("USE_LLM_SECTION", "1") == "1"
 
-    daily = []
+    keyed = []
+    pending = {}
     for it in merged_items:
         cache_key = it.get("doi") or it.get("pmid") or it.get("title")
-        cached = cache.get(cache_key) or {}
-        if isinstance(cached, str):
-            cached = {"summary_ja": cached, "summary_short_ja": ""}
-
-        summary = cached.get("summary_ja", "")
-        summary_short = cached.get("summary_short_ja", "")
-        cached_section = cached.get("section_llm", "")
-
-        if not summary:
-            summary = summarize(client, it.get("title", ""), it.get("abstract", ""))
-        if not summary_short:
-            summary_short = summarize_short(
-                client, it.get("title", ""), it.get("abstract", "")
-            )
-
-        use_llm_section = os.environ.get("USE_LLM_SECTION", "1") == "1"
-        section_llm = cached_section
-        if use_llm_section and not section_llm:
-            section_llm = classify_section_llm(
-                client, it.get("title", ""), it.get("abstract", "")
-            )
+        # The same paper often arrives from PubMed and Europe PMC with different
+        # identifiers, so also look it up by content. Without an abstract the
+        # title alone is too generic ("Erratum", "Reply") to alias on.
+        alias_key = None
+        if it.get("abstract"):
+            alias_key = content_key(it.get("title", ""), it.get("abstract", ""))
+        keys = [k for k in (cache_key, alias_key) if k]
+        hits = {k: get_cached_summary(cache, k) for k in keys}
+        missed = [k for k in keys if hits[k] is None]
+        pending_key = alias_key or cache_key
+        if pending_key in pending:
+            entry = pending[pending_key][1]
+            keyed.append((it, entry, {}, missed, keys))
+            continue
+        cached = next((h for h in hits.values() if h), {})
+        entry = {
+            "summary_ja": cached.get("summary_ja", ""),
+            "summary_short_ja": cached.get("summary_short_ja", ""),
+            "section_llm": cached.get("section_llm", ""),
+        }
+        if not (
+            entry["summary_ja"]
+            and entry["summary_short_ja"]
+            and (entry["section_llm"] or not use_llm_section)
+        ):
+            pending[pending_key] = (it, entry)
+        keyed.append((it, entry, dict(entry), missed, keys))
+
+    if pending:
+        asyncio.run(fill_entries(list(pending.values()), use_llm_section))
 
-        if summary or summary_short or section_llm:
-            cache[cache_key] = {
-                "summary_ja": summary,
-                "summary_short_ja": summary_short,
-                "section_llm": section_llm,
-            }
-        disease_id = match_disease(it.get("title", ""), it.get("abstract", ""), diseases)
-        section_id = section_llm or match_section(
-            it.get("title", ""), it.get("abstract", ""), sections
-        )
+    daily = []
+    cache_updates = {}
+    for it, entry, before, missed, keys in keyed:
+        # Only write keys that were missing or whose entry the model just filled,
+        # so pure cache hits leave the committed DB untouched.
+        if entry["summary_ja"] or entry["summary_short_ja"] or entry["section_llm"]:
+            dirty = keys if entry != before else missed
+            cache_updates.update((k, entry) for k in dirty)
+        text = normalize_text(f"{it.get('title', '')} {it.get('abstract', '')}")
+        disease_id = match_disease(text, disease_terms)
+        section_id = entry["section_llm"] or match_section(text, section_keywords)
         daily.append(
             {
                 **it,
-                "summary_ja": summary,
-                "summary_short_ja": summary_short,
+                "summary_ja": entry["summary_ja"],
+                "summary_short_ja": entry["summary_short_ja"],
                 "disease": disease_id or "other",
                 "section": section_id,
             }
         )
 
-    save_json(cache_path, cache)
+    put_cached_summaries(cache, list(cache_updates.items()))
+    cache.close()
 
     date_str = today.strftime("%Y-%m-%d")
     daily_path = ROOT / "data" / "daily" / f"{date_str}.json"
@@ -309,17 +407,22 @@ def main() -> None:
             seen.add(key)
             merged_items.append(it)
 
+        # Leave untouched files alone so build_site can skip their pages.
+        if merged_items == existing_items and disease_path.exists():
+            continue
         existing["items"] = merged_items
         save_json(disease_path, existing)
 
     # Update disease wiki text (per section) with minimal changes
     text_dir = ROOT / "data" / "disease_text"
     text_dir.mkdir(parents=True, exist_ok=True)
+    texts = {}
+    jobs = []
     for d in diseases:
         did = d["id"]
-        disease_text_path = text_dir / f"{did}.json"
-        existing_text = load_json(disease_text_path, {"disease": did, "sections": {}})
-        sections_text = existing_text.get("sections", {})
+        existing_text = load_json(text_dir / f"{did}.json", {"disease": did, "sections": {}})
+        sections_text = existing_text.setdefault("sections", {})
+        texts[did] = existing_text
 
         for s in sections:
             sid = s["id"]
@@ -341,18 +444,19 @@ def main() -> None:
                 f"新しい要約:\\n{new_summaries}\\n\\n"
                 "更新後の本文:"
             )
-            model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-            resp = client.responses.create(
-                model=model,
-                input=prompt,
-                temperature=0.2,
-            )
-            updated = resp.output_text.strip()
-            if updated:
-                sections_text[sid] = updated
+            jobs.append((did, sid, prompt))
+
+    updates = asyncio.run(complete_all([p for _, _, p in jobs])) if jobs else []
+    changed = set()
+    for (did, sid, _), updated in zip(jobs, updates):
+        if updated:
+            texts[did]["sections"][sid] = updated
+            changed.add(did)
 
-        existing_text["sections"] = sections_text
-        save_json(disease_text_path, existing_text)
+    for did, existing_text in texts.items():
+        disease_text_path = text_dir / f"{did}.json"
+        if did in changed or not disease_text_path.exists():
+            save_json(disease_text_path, existing_text)
 
     from build_site import build_site
 
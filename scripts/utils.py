@@ -1,25 +1,40 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import re
+import sqlite3
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import AbstractSet, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
 
 import yaml
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
 ROOT = Path(__file__).resolve().parents[1]
 
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
 
 def load_yaml(path: Path) -> dict:
-    with path.open("r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    return yaml.load(path.read_bytes(), Loader=_YAML_LOADER)
 
 
 def normalize_title(title: str) -> str:
     if not title:
         return ""
-    t = re.sub(r"[^a-z0-9]+", " ", title.lower())
-    return re.sub(r"\s+", " ", t).strip()
+    return _NON_ALNUM.sub(" ", title.lower()).strip()
+
+
+def content_key(title: str, abstract: str) -> str:
+    text = normalize_title(title) + "|" + (abstract or "")[:2000]
+    return "sha:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 def normalize_text(text: str) -> str:
@@ -29,8 +44,18 @@ def normalize_text(text: str) -> str:
     t = t.replace("’", "'")
     t = t.replace("'", "")
     t = t.replace("-", " ")
-    t = re.sub(r"[^a-z0-9]+", " ", t)
-    return re.sub(r"\s+", " ", t).strip()
+    return _NON_ALNUM.sub(" ", t).strip()
+
+
+def minimize_terms(terms: Iterable[str]) -> List[str]:
+    # A phrase search for "stroke" already matches "ischemic stroke", so drop
+    # any term that contains a shorter kept term as whole words.
+    unique = {" ".join(t.lower().split()) for t in terms}
+    keep = []
+    for t in sorted(unique - {""}, key=lambda t: (len(t), t)):
+        if not any(f" {k} " in f" {t} " for k in keep):
+            keep.append(t)
+    return keep
 
 
 def choose_key(doi: Optional[str], pmid: Optional[str], title: str) -> str:
@@ -41,65 +66,145 @@ def choose_key(doi: Optional[str], pmid: Optional[str], title: str) -> str:
     return f"title:{normalize_title(title)}"
 
 
+# Config loaders are memoized per process: run_daily and build_site both
+# read them, so callers must treat the returned objects as read-only.
+@lru_cache(maxsize=1)
 def load_journal_whitelist() -> List[dict]:
     data = load_yaml(ROOT / "config" / "journals.yaml")
     return data.get("journals", [])
 
 
-def is_whitelisted(journal: str, whitelist: List[dict]) -> bool:
+def build_whitelist_set(whitelist: List[dict]) -> FrozenSet[str]:
+    names = (
+        str(n).lower().strip()
+        for item in whitelist
+        for n in [item.get("name", "")] + item.get("aliases", [])
+    )
+    return frozenset(n for n in names if n)
+
+
+# Compatibility entry point: run_daily checks the set returned by
+# build_whitelist_set() directly, but this still accepts either a set of
+# names or the raw journals.yaml list.
+def is_whitelisted(journal: str, whitelist: Union[AbstractSet[str], List[dict]]) -> bool:
     if not journal:
         return False
-    j = journal.lower().strip()
-    for item in whitelist:
-        names = [item.get("name", "")] + item.get("aliases", [])
-        for n in names:
-            if j == str(n).lower().strip():
-                return True
-    return False
+    if not isinstance(whitelist, AbstractSet):
+        whitelist = build_whitelist_set(whitelist)
+    return journal.lower().strip() in whitelist
 
 
+@lru_cache(maxsize=1)
 def load_disease_config() -> dict:
     return load_yaml(ROOT / "config" / "diseases.yaml")
 
 
-def match_disease(title: str, abstract: str, diseases: List[dict]) -> Optional[str]:
-    text = normalize_text(f"{title} {abstract}")
-    tokens = set(text.split())
+def compile_disease_terms(diseases: List[dict]) -> List[Tuple[str, List[str], FrozenSet[str]]]:
+    compiled = []
     for d in diseases:
+        phrases = []
+        words = set()
         for term in d.get("terms", []):
             t = normalize_text(term)
             if not t:
                 continue
-            if " " in t:
-                if t in text:
-                    return d["id"]
+            # Short single words (PD, ALS, TIA) only match whole tokens.
+            if " " not in t and len(t) <= 4:
+                words.add(t)
             else:
-                if len(t) <= 4:
-                    if t in tokens:
-                        return d["id"]
-                else:
-                    if t in text:
-                        return d["id"]
+                phrases.append(t)
+        compiled.append((d["id"], phrases, frozenset(words)))
+    return compiled
+
+
+def compile_section_keywords(sections: List[dict]) -> List[Tuple[str, List[str]]]:
+    return [(s["id"], [normalize_text(kw) for kw in s.get("keywords", [])]) for s in sections]
+
+
+# Both matchers take the article text already passed through normalize_text,
+# so it is normalized once per article rather than once per matcher.
+def match_disease(
+    text: str, disease_terms: List[Tuple[str, List[str], FrozenSet[str]]]
+) -> Optional[str]:
+    tokens = set(text.split())
+    for did, phrases, words in disease_terms:
+        if not words.isdisjoint(tokens) or any(t in text for t in phrases):
+            return did
     return None
 
 
-def match_section(title: str, abstract: str, sections: List[dict]) -> str:
-    text = normalize_text(f"{title} {abstract}")
-    for s in sections:
-        for kw in s.get("keywords", []):
-            if normalize_text(kw) in text:
-                return s["id"]
+def match_section(text: str, section_keywords: List[Tuple[str, List[str]]]) -> str:
+    for sid, keywords in section_keywords:
+        if any(kw in text for kw in keywords):
+            return sid
     return "treatment"
 
 
+def _dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 def load_json(path: Path, default):
-    if not path.exists():
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
         return default
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return _loads(raw)
 
 
 def save_json(path: Path, data) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    path.write_bytes(_dumps(data))
+
+
+_CACHE_FIELDS = ("summary_ja", "summary_short_ja", "section_llm")
+
+
+def _cache_row(key: str, entry) -> tuple:
+    # Very old cache entries stored only the long summary as a bare string.
+    if isinstance(entry, str):
+        entry = {"summary_ja": entry}
+    return (key, *[entry.get(f) or "" for f in _CACHE_FIELDS])
+
+
+def open_cache(path: Path = ROOT / "data" / "cache" / "summaries.db") -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS summaries ("
+        "key TEXT PRIMARY KEY, summary_ja TEXT, summary_short_ja TEXT, section_llm TEXT)"
+    )
+    # Import the old JSON cache for as long as it exists; it is only removed
+    # once the import has committed, so a failed import is retried next run.
+    # Rows already in the DB are newer and win.
+    legacy = path.with_suffix(".json")
+    if legacy.exists():
+        rows = [_cache_row(k, v) for k, v in load_json(legacy, {}).items()]
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO summaries VALUES (?, ?, ?, ?)", rows)
+        legacy.unlink()
+    return conn
+
+
+def get_cached_summary(conn: sqlite3.Connection, key: str) -> Optional[dict]:
+    row = conn.execute(
+        "SELECT summary_ja, summary_short_ja, section_llm FROM summaries WHERE key = ?",
+        (key,),
+    ).fetchone()
+    return dict(zip(_CACHE_FIELDS, row)) if row else None
+
+
+def put_cached_summaries(conn: sqlite3.Connection, entries: List[Tuple[str, dict]]) -> None:
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+            [_cache_row(k, entry) for k, entry in entries],
+        )